@@ -1,7 +1,135 @@
 import logging
-from kubernetes import client, config
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+from kubernetes import client, watch
+from my_playbook_repo.kube_client import MAX_CONCURRENT_PATCHES, call_with_retry, get_v1, json_loads
 from robusta.api import *
 
+STATEFUL_LABEL_KEY = "node.paytm.com/group"
+STATEFUL_LABEL_VALUES = frozenset({"stateful"})
+STATEFUL_LABEL_SELECTOR = f"{STATEFUL_LABEL_KEY} in ({','.join(sorted(STATEFUL_LABEL_VALUES))})"
+
+# Selector terms that require a label value: key=value, key==value or key in (values).
+# Negative terms (!=, notin, !key) and bare existence checks are rejected, since they could match
+# most of the cluster.
+_SELECTOR_TERM_SPLIT_RE = re.compile(r",(?![^()]*\))")
+_POSITIVE_SELECTOR_TERM_RE = re.compile(
+    r"^\s*[\w./-]+\s*(?:==?\s*[\w.-]+|\s+in\s*\(\s*[\w.-]+(?:\s*,\s*[\w.-]+)*\s*\))\s*$"
+)
+
+
+def _is_positive_selector(label_selector: str) -> bool:
+    return all(_POSITIVE_SELECTOR_TERM_RE.match(term) for term in _SELECTOR_TERM_SPLIT_RE.split(label_selector))
+
+# A JSON patch avoids the schema lookup a strategic merge patch needs on the apiserver.
+# "add" rather than "replace", since spec.unschedulable is omitted on schedulable nodes
+_CORDON_PATCH = [{"op": "add", "path": "/spec/unschedulable", "value": True}]
+
+# Bound each watch like client-go's reflector does, and time out socket reads shortly after, so a
+# half-open connection is noticed instead of silently leaving the cache stale
+_WATCH_TIMEOUT_SECONDS = 5 * 60
+_WATCH_REQUEST_TIMEOUT = (10, _WATCH_TIMEOUT_SECONDS + 30)
+_LIST_REQUEST_TIMEOUT = (10, 60)
+
+_WATCH_RETRY_BASE_DELAY_SECONDS = 5
+_WATCH_RETRY_MAX_DELAY_SECONDS = 5 * 60
+
+
+class NodeCache:
+    """
+    In-memory view of the nodes matching a label selector, kept up to date by a background watch.
+    """
+
+    def __init__(self, label_selector: str):
+        self.label_selector = label_selector
+        self.synced = False
+        self._nodes: Dict[str, client.V1Node] = {}
+        self._uncordoned: Set[str] = set()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"node-cache-{label_selector}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def get(self, node_name: str) -> Optional[client.V1Node]:
+        with self._lock:
+            return self._nodes.get(node_name)
+
+    def stateful_uncordoned(self) -> Set[str]:
+        with self._lock:
+            return set(self._uncordoned)
+
+    def _update(self, event_type: str, node: client.V1Node):
+        name = node.metadata.name
+        with self._lock:
+            if event_type == "DELETED":
+                self._nodes.pop(name, None)
+                self._uncordoned.discard(name)
+                return
+            self._nodes[name] = node
+            if node.spec.unschedulable:
+                self._uncordoned.discard(name)
+            else:
+                self._uncordoned.add(name)
+
+    def _list(self) -> str:
+        node_list = get_v1().list_node(label_selector=self.label_selector, _request_timeout=_LIST_REQUEST_TIMEOUT)
+        with self._lock:
+            self._nodes = {node.metadata.name: node for node in node_list.items}
+            self._uncordoned = {name for name, node in self._nodes.items() if not node.spec.unschedulable}
+        self.synced = True
+        return node_list.metadata.resource_version
+
+    def _run(self):
+        resource_version = None
+        failures = 0
+        while True:
+            try:
+                if resource_version is None:
+                    resource_version = self._list()
+                    failures = 0
+                for watch_event in watch.Watch().stream(
+                    get_v1().list_node,
+                    label_selector=self.label_selector,
+                    resource_version=resource_version,
+                    timeout_seconds=_WATCH_TIMEOUT_SECONDS,
+                    _request_timeout=_WATCH_REQUEST_TIMEOUT,
+                ):
+                    node = watch_event["object"]
+                    resource_version = node.metadata.resource_version
+                    self._update(watch_event["type"], node)
+            except Exception as e:
+                resource_version = None
+                # 410 Gone only means our resource version expired, so we just relist
+                if isinstance(e, client.exceptions.ApiException) and e.status == 410:
+                    continue
+                self.synced = False
+                failures += 1
+                # Log the first failure loudly and back off exponentially, so a watch that keeps
+                # failing (e.g. RBAC without list/watch on nodes) doesn't flood the logs
+                log = logging.error if failures == 1 else logging.debug
+                log("Node watch for %s failed (attempt %s): %s", self.label_selector, failures, e)
+                time.sleep(min(_WATCH_RETRY_BASE_DELAY_SECONDS * 2 ** (failures - 1), _WATCH_RETRY_MAX_DELAY_SECONDS))
+
+
+# Only the default stateful selector is cached; other selectors are listed on demand, so user input
+# can't start additional watch threads
+_STATEFUL_NODE_CACHE: Optional[NodeCache] = None
+_STATEFUL_NODE_CACHE_LOCK = threading.Lock()
+
+
+def _get_stateful_node_cache() -> NodeCache:
+    global _STATEFUL_NODE_CACHE
+    with _STATEFUL_NODE_CACHE_LOCK:
+        if _STATEFUL_NODE_CACHE is None:
+            _STATEFUL_NODE_CACHE = NodeCache(STATEFUL_LABEL_SELECTOR)
+            _STATEFUL_NODE_CACHE.start()
+        return _STATEFUL_NODE_CACHE
+
+
 class CordonStatefulNodesParams(ActionParams):
     """
     :var node_name: name of the node to cordon
@@ -12,9 +140,9 @@ class CordonStatefulNodesParams(ActionParams):
 @action
 def cordon_stateful_nodes(event: ExecutionBaseEvent, params: CordonStatefulNodesParams):
     """
-    Cordon the node where the label node.paytm.com/group contains the value stateful.
+    Cordon the node if its node.paytm.com/group label is one of the stateful values.
     """
-    logging.info(f"Received parameters: {params}")
+    logging.debug("Received parameters: %s", params)
 
     node_name = params.node_name
 
@@ -22,37 +150,43 @@ def cordon_stateful_nodes(event: ExecutionBaseEvent, params: CordonStatefulNodes
         logging.error("Node name is missing in the parameters.")
         raise ActionException(ErrorCodes.ACTION_VALIDATION_ERROR, "Node name is missing in the parameters.")
 
-    logging.info(f"Node name to cordon: {node_name}")
-
-    try:
-        config.load_incluster_config()
-    except config.ConfigException:
-        config.load_kube_config()
+    logging.debug("Node name to cordon: %s", node_name)
 
-    v1 = client.CoreV1Api()
+    v1 = get_v1()
 
-    # Get the node
-    try:
-        node = v1.read_node(name=node_name)
-    except client.exceptions.ApiException as e:
-        logging.error(f"Failed to read node {node_name}: {e}")
-        raise ActionException(ErrorCodes.ACTION_UNEXPECTED_ERROR, f"Failed to read node {node_name} {e}")
+    # Get the node, going to the apiserver only when the stateful node cache is not synced or misses.
+    # An unsynced cache can hold stale entries whose label or cordon state has since changed.
+    cache = _get_stateful_node_cache()
+    node = cache.get(node_name) if cache.synced else None
+    if node is not None:
+        labels = node.metadata.labels or {}
+        unschedulable = bool(node.spec.unschedulable)
+    else:
+        try:
+            # Skip building the full V1Node model, only the labels and unschedulable flag are needed
+            response = call_with_retry(v1.read_node, name=node_name, _preload_content=False)
+        except client.exceptions.ApiException as e:
+            logging.error("Failed to read node %s: %s", node_name, e)
+            raise ActionException(ErrorCodes.ACTION_UNEXPECTED_ERROR, f"Failed to read node {node_name} {e}")
+        raw_node = json_loads(response.data)
+        labels = raw_node["metadata"].get("labels") or {}
+        unschedulable = bool(raw_node.get("spec", {}).get("unschedulable"))
 
     # Check if the node has the required label and is not already cordoned
-    labels = node.metadata.labels
-    if any("stateful" in value for value in labels.values()):
-        if node.spec.unschedulable:
-            event.add_enrichment([MarkdownBlock(f"Node {node.metadata.name} already cordoned")])
-        else:
-            try:
-                v1.patch_node(node.metadata.name, {"spec": {"unschedulable": True}})
-                event.add_enrichment([MarkdownBlock(f"Node {node.metadata.name} cordoned")])
-                logging.info(f"Node {node.metadata.name} cordoned")
-            except Exception as e:
-                logging.error(f"Failed to cordon node {node.metadata.name}: {e}")
-                raise ActionException(ErrorCodes.ACTION_UNEXPECTED_ERROR, f"Failed to cordon node {node.metadata.name} {e}")
-    else:
-        logging.info(f"Node {node.metadata.name} does not have the required label, skipping cordon action.")
+    if labels.get(STATEFUL_LABEL_KEY) not in STATEFUL_LABEL_VALUES:
+        logging.info("Node %s does not have the required label, skipping cordon action.", node_name)
+        return
+
+    if unschedulable:
+        event.add_enrichment([MarkdownBlock(f"Node {node_name} already cordoned")])
+        return
+
+    try:
+        call_with_retry(v1.patch_node, node_name, _CORDON_PATCH, _content_type="application/json-patch+json")
+        logging.info("Node %s cordoned", node_name)
+    except Exception as e:
+        logging.error("Failed to cordon node %s: %s", node_name, e)
+        raise ActionException(ErrorCodes.ACTION_UNEXPECTED_ERROR, f"Failed to cordon node {node_name} {e}")
 
     # Add findings and enrichment
     event.add_finding(
@@ -65,6 +199,84 @@ def cordon_stateful_nodes(event: ExecutionBaseEvent, params: CordonStatefulNodes
     )
     event.add_enrichment(
         [
-            MarkdownBlock(f"Node {node.metadata.name} cordoned")
+            MarkdownBlock(f"Node {node_name} cordoned")
         ]
-    )
\ No newline at end of file
+    )
+
+class CordonAllStatefulNodesParams(ActionParams):
+    """
+    :var label_selector: label selector (key=value or key in (values)) matching the stateful nodes to cordon
+    :example label_selector: node.paytm.com/group in (stateful)
+    """
+    label_selector: str = STATEFUL_LABEL_SELECTOR
+
+@action
+def cordon_all_stateful_nodes(event: ExecutionBaseEvent, params: CordonAllStatefulNodesParams):
+    """
+    Cordon every schedulable node matching the label selector.
+    """
+    logging.debug("Received parameters: %s", params)
+
+    if not _is_positive_selector(params.label_selector):
+        logging.error("Label selector %s must only use key=value, key==value or key in (values) terms.", params.label_selector)
+        raise ActionException(
+            ErrorCodes.ACTION_VALIDATION_ERROR,
+            f"Label selector {params.label_selector} must only use key=value, key==value or key in (values) terms.",
+        )
+
+    v1 = get_v1()
+
+    cache = _get_stateful_node_cache() if params.label_selector == STATEFUL_LABEL_SELECTOR else None
+    if cache is not None and cache.synced:
+        node_names = sorted(cache.stateful_uncordoned())
+    else:
+        # No synced cache for this selector. Let the apiserver return only the matching nodes that are
+        # not cordoned yet, decoding the raw response as plain JSON since only the node names are used.
+        try:
+            response = call_with_retry(
+                v1.list_node,
+                label_selector=params.label_selector,
+                field_selector="spec.unschedulable=false",
+                _preload_content=False,
+            )
+        except client.exceptions.ApiException as e:
+            logging.error("Failed to list nodes matching %s: %s", params.label_selector, e)
+            raise ActionException(ErrorCodes.ACTION_UNEXPECTED_ERROR, f"Failed to list nodes matching {params.label_selector} {e}")
+
+        node_names = [item["metadata"]["name"] for item in json_loads(response.data)["items"]]
+
+    if not node_names:
+        logging.info("No schedulable nodes match %s, skipping cordon action.", params.label_selector)
+        return
+
+    def cordon(node_name: str) -> Optional[Exception]:
+        try:
+            call_with_retry(v1.patch_node, node_name, _CORDON_PATCH, _content_type="application/json-patch+json")
+            logging.debug("Node %s cordoned", node_name)
+            return None
+        except Exception as e:
+            logging.error("Failed to cordon node %s: %s", node_name, e)
+            return e
+
+    # Cordon all nodes concurrently so the total latency is close to a single round-trip
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_PATCHES) as executor:
+        errors = list(executor.map(cordon, node_names))
+
+    cordoned_nodes = [name for name, error in zip(node_names, errors) if error is None]
+    failed_nodes: List[Tuple[str, Exception]] = [(name, error) for name, error in zip(node_names, errors) if error is not None]
+
+    lines = [f"Cordoned {len(cordoned_nodes)} of {len(node_names)} nodes matching {params.label_selector}"]
+    if cordoned_nodes:
+        lines.append("Cordoned:\n- " + "\n- ".join(cordoned_nodes))
+    if failed_nodes:
+        lines.append("Failed:\n- " + "\n- ".join(f"{name}: {error}" for name, error in failed_nodes))
+
+    event.add_finding(
+        Finding(
+            title="Failed to cordon Stateful Nodes" if failed_nodes else "Cordoned Stateful Nodes",
+            aggregation_key="CordonStatefulNodes",
+            finding_type=FindingType.ISSUE if failed_nodes else FindingType.REPORT,
+            failure=bool(failed_nodes),
+        )
+    )
+    event.add_enrichment([MarkdownBlock("\n\n".join(lines))])
@@ -0,0 +1,75 @@
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+from kubernetes import client, config
+
+# Raw (_preload_content=False) responses skip the client's model deserialization and are decoded
+# with orjson when it is installed
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# Rebuild the client periodically so rotated in-cluster credentials are picked up
+_V1_CLIENT_TTL_SECONDS = 10 * 60
+
+# Retry throttled (429) and transient server errors with exponential backoff
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+_RETRY_ATTEMPTS = 5
+_RETRY_BASE_DELAY_SECONDS = 0.1
+_RETRY_MAX_DELAY_SECONDS = 2.0
+# Give up instead of retrying when the server asks us to wait longer than this, so actions and
+# batch worker threads aren't held for minutes
+_RETRY_AFTER_MAX_SECONDS = 5
+
+# Upper bound on concurrent PATCHes issued by the batch actions, to stay within the apiserver's QPS limits
+MAX_CONCURRENT_PATCHES = 20
+
+# Large enough for MAX_CONCURRENT_PATCHES plus the node watch and other in-flight calls
+_CONNECTION_POOL_MAXSIZE = 32
+
+_V1_CLIENT: Optional[client.CoreV1Api] = None
+_V1_CLIENT_CREATED_AT = 0.0
+_V1_CLIENT_LOCK = threading.Lock()
+
+
+def get_v1() -> client.CoreV1Api:
+    """
+    Return a CoreV1Api shared by all actions, loading the kube config only when it is (re)built.
+    """
+    global _V1_CLIENT, _V1_CLIENT_CREATED_AT
+    with _V1_CLIENT_LOCK:
+        now = time.monotonic()
+        if _V1_CLIENT is None or now - _V1_CLIENT_CREATED_AT > _V1_CLIENT_TTL_SECONDS:
+            configuration = client.Configuration()
+            try:
+                config.load_incluster_config(client_configuration=configuration)
+            except config.ConfigException:
+                config.load_kube_config(client_configuration=configuration)
+            configuration.connection_pool_maxsize = _CONNECTION_POOL_MAXSIZE
+            _V1_CLIENT = client.CoreV1Api(api_client=client.ApiClient(configuration))
+            _V1_CLIENT_CREATED_AT = now
+        return _V1_CLIENT
+
+
+T = TypeVar("T")
+
+
+def call_with_retry(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Call an API method, retrying on throttling and transient server errors.
+    Retries go through the same pooled client, so they reuse its connections.
+    """
+    for attempt in range(_RETRY_ATTEMPTS):
+        try:
+            return func(*args, **kwargs)
+        except client.exceptions.ApiException as e:
+            if e.status not in _RETRY_STATUSES or attempt == _RETRY_ATTEMPTS - 1:
+                raise
+            delay = min(_RETRY_BASE_DELAY_SECONDS * 2 ** attempt, _RETRY_MAX_DELAY_SECONDS)
+            retry_after = (e.headers or {}).get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                if int(retry_after) > _RETRY_AFTER_MAX_SECONDS:
+                    raise
+                delay = max(delay, int(retry_after))
+            time.sleep(delay)
@@ -1,9 +1,62 @@
 import logging
-from kubernetes import client, config
-from hikaru.meta import KubernetesException
-from hikaru.model.rel_1_26 import PersistentVolumeClaim
+import math
+import re
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from kubernetes import client
+from kubernetes.utils import parse_quantity
+from my_playbook_repo.kube_client import MAX_CONCURRENT_PATCHES, call_with_retry, get_v1, json_loads
 from robusta.api import *
 
+_QTY_RE = re.compile(r"^(\d+)(Ki|Mi|Gi|Ti|Pi|Ei)$")
+_QTY_UNITS = ["Ki", "Mi", "Gi", "Ti", "Pi", "Ei"]
+
+_RESIZE_CONDITIONS = frozenset({"Resizing", "FileSystemResizePending"})
+
+
+def _grow_quantity(quantity: str, factor: float) -> Optional[str]:
+    """
+    Scale a binary-suffixed Kubernetes quantity (e.g. 10Gi) by factor, rounding up.
+    Switches to a smaller unit when the increase is less than one unit (1Ti -> 1076Gi),
+    and always grows by at least one unit. Returns None if the quantity isn't in that form.
+    """
+    match = _QTY_RE.match(quantity)
+    if not match:
+        return None
+    # Decimal keeps e.g. 300 * 1.05 at exactly 315 so rounding up doesn't overshoot
+    exact_factor = Decimal(str(factor))
+    value, unit_index = int(match.group(1)), _QTY_UNITS.index(match.group(2))
+    while unit_index > 0 and value * (exact_factor - 1) < 1:
+        value, unit_index = value * 1024, unit_index - 1
+    return f"{max(math.ceil(value * exact_factor), value + 1)}{_QTY_UNITS[unit_index]}"
+
+
+def _resize_in_progress(pvc: Dict) -> bool:
+    """
+    True if an expansion of the (raw JSON) PVC is still in flight: it has a Resizing or
+    FileSystemResizePending condition, or its provisioned capacity is below the requested size.
+    """
+    status = pvc.get('status') or {}
+    if any(
+        condition.get('type') in _RESIZE_CONDITIONS and condition.get('status') == "True"
+        for condition in status.get('conditions') or []
+    ):
+        return True
+    capacity = (status.get('capacity') or {}).get('storage')
+    requested = pvc['spec']['resources']['requests']['storage']
+    return capacity is not None and parse_quantity(capacity) < parse_quantity(requested)
+
+
+class _PVCResize(NamedTuple):
+    name: str
+    current_size: str
+    new_size: str
+
+
+def _storage_patch(new_size_str: str) -> List[Dict[str, str]]:
+    return [{"op": "replace", "path": "/spec/resources/requests/storage", "value": new_size_str}]
+
 @action
 def my_action(event: PodEvent):
     # we have full access to the pod on which the alert fired
@@ -32,9 +85,11 @@ def resize_persistent_volume(event: ExecutionBaseEvent, params: ResizePVCParams)
     """
     Resize the PersistentVolumeClaim by increasing its size by 5%.
     """
+    v1 = get_v1()
     try:
-        pvc = PersistentVolumeClaim().read(name=params.name, namespace=params.namespace)
-    except KubernetesException:
+        # Skip building the full V1PersistentVolumeClaim model, only the sizes are needed
+        response = call_with_retry(v1.read_namespaced_persistent_volume_claim, params.name, params.namespace, _preload_content=False)
+    except client.exceptions.ApiException:
         event.add_finding(
             Finding(
                 title=f"Error resizing PersistentVolumeClaim {params.name}",
@@ -52,14 +107,53 @@ def resize_persistent_volume(event: ExecutionBaseEvent, params: ResizePVCParams)
         )
         return
 
-    current_size = pvc.spec.resources.requests['storage']
-    new_size = int(current_size.strip('Gi')) * 1.05
-    new_size_str = f"{int(new_size)}Gi"
+    pvc = json_loads(response.data)
+    current_size = pvc['spec']['resources']['requests']['storage']
+    new_size_str = _grow_quantity(current_size, 1.05)
+    if new_size_str is None:
+        logging.error("Unsupported size %s for PVC %s", current_size, params.name)
+        event.add_finding(
+            Finding(
+                title=f"Error resizing PersistentVolumeClaim {params.name}",
+                aggregation_key="PVCResizeError",
+                finding_type=FindingType.ISSUE,
+                failure=True,
+            )
+        )
+        event.add_enrichment(
+            [
+                MarkdownBlock(
+                    f"Resize failed for PersistentVolumeClaim {params.name} in namespace {params.namespace} due to unsupported size {current_size}"
+                )
+            ]
+        )
+        return
+
+    if _resize_in_progress(pvc):
+        logging.info("Skipping resize of PVC %s in namespace %s, a resize to %s is in progress", params.name, params.namespace, current_size)
+        event.add_finding(
+            Finding(
+                title=f"PersistentVolumeClaim {params.name} is already being resized",
+                aggregation_key="PVCResizeSuccess",
+                finding_type=FindingType.REPORT,
+                failure=False,
+            )
+        )
+        event.add_enrichment(
+            [
+                MarkdownBlock(
+                    f"PVC {params.name} in namespace {params.namespace} is still being resized to {current_size}"
+                )
+            ]
+        )
+        return
 
-    pvc.spec.resources.requests['storage'] = new_size_str
     try:
-        pvc.patch()
-        logging.info(f"Resized PVC {params.name} in namespace {params.namespace} from {current_size} to {new_size_str}")
+        call_with_retry(
+            v1.patch_namespaced_persistent_volume_claim,
+            params.name, params.namespace, _storage_patch(new_size_str), _content_type="application/json-patch+json"
+        )
+        logging.info("Resized PVC %s in namespace %s from %s to %s", params.name, params.namespace, current_size, new_size_str)
         event.add_finding(
             Finding(
                 title=f"Resized PersistentVolumeClaim {params.name}",
@@ -75,8 +169,8 @@ def resize_persistent_volume(event: ExecutionBaseEvent, params: ResizePVCParams)
                 )
             ]
         )
-    except KubernetesException as e:
-        logging.error(f"Failed to resize PVC {params.name}: {e}")
+    except client.exceptions.ApiException as e:
+        logging.error("Failed to resize PVC %s: %s", params.name, e)
         event.add_finding(
             Finding(
                 title=f"Error resizing PersistentVolumeClaim {params.name}",
@@ -92,3 +186,94 @@ def resize_persistent_volume(event: ExecutionBaseEvent, params: ResizePVCParams)
                 )
             ]
         )
+
+class BatchResizePVCParams(ActionParams):
+    """
+    :var label_selector: label selector matching the PersistentVolumeClaims to resize
+    :var namespace: namespace of the PersistentVolumeClaims to resize
+    :example label_selector: app=my-database
+    """
+    label_selector: str
+    namespace: str = "default"
+
+@action
+def resize_persistent_volumes_batch(event: ExecutionBaseEvent, params: BatchResizePVCParams):
+    """
+    Resize all PersistentVolumeClaims matching the label selector by increasing their size by 5%.
+    """
+    v1 = get_v1()
+    try:
+        response = call_with_retry(
+            v1.list_namespaced_persistent_volume_claim,
+            params.namespace,
+            label_selector=params.label_selector,
+            _preload_content=False,
+        )
+    except client.exceptions.ApiException as e:
+        logging.error("Failed to list PVCs matching %s in namespace %s: %s", params.label_selector, params.namespace, e)
+        raise ActionException(ErrorCodes.ACTION_UNEXPECTED_ERROR, f"Failed to list PVCs matching {params.label_selector} {e}")
+
+    pvcs = json_loads(response.data)["items"]
+    if not pvcs:
+        logging.info("No PVCs match %s in namespace %s, skipping resize action.", params.label_selector, params.namespace)
+        return
+
+    to_resize: List[_PVCResize] = []
+    skipped: List[Tuple[str, str]] = []
+    failed: List[Tuple[str, str]] = []
+    for pvc in pvcs:
+        name = pvc["metadata"]["name"]
+        current_size = pvc["spec"]["resources"]["requests"]["storage"]
+        new_size_str = _grow_quantity(current_size, 1.05)
+        if new_size_str is None:
+            failed.append((name, f"unsupported size {current_size}"))
+        elif _resize_in_progress(pvc):
+            skipped.append((name, f"still being resized to {current_size}"))
+        else:
+            to_resize.append(_PVCResize(name, current_size, new_size_str))
+
+    def resize(pvc_resize: _PVCResize) -> Optional[str]:
+        try:
+            call_with_retry(
+                v1.patch_namespaced_persistent_volume_claim,
+                pvc_resize.name, params.namespace, _storage_patch(pvc_resize.new_size), _content_type="application/json-patch+json"
+            )
+            return None
+        except client.exceptions.ApiException as e:
+            logging.error("Failed to resize PVC %s: %s", pvc_resize.name, e)
+            return str(e)
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_PATCHES) as executor:
+        errors = list(executor.map(resize, to_resize))
+
+    resized: List[_PVCResize] = []
+    for pvc_resize, error in zip(to_resize, errors):
+        if error is None:
+            resized.append(pvc_resize)
+        else:
+            failed.append((pvc_resize.name, error))
+
+    lines = [f"Resized {len(resized)} of {len(pvcs)} PVCs matching {params.label_selector} in namespace {params.namespace}"]
+    if resized:
+        lines.append("Resized:\n- " + "\n- ".join(f"{r.name} from {r.current_size} to {r.new_size}" for r in resized))
+    if skipped:
+        lines.append("Skipped:\n- " + "\n- ".join(f"{name}: {reason}" for name, reason in skipped))
+    if failed:
+        lines.append("Failed:\n- " + "\n- ".join(f"{name}: {reason}" for name, reason in failed))
+
+    if failed:
+        title = f"Error resizing PersistentVolumeClaims matching {params.label_selector}"
+    elif resized:
+        title = f"Resized PersistentVolumeClaims matching {params.label_selector}"
+    else:
+        title = f"PersistentVolumeClaims matching {params.label_selector} are already being resized"
+
+    event.add_finding(
+        Finding(
+            title=title,
+            aggregation_key="PVCResizeError" if failed else "PVCResizeSuccess",
+            finding_type=FindingType.ISSUE if failed else FindingType.REPORT,
+            failure=bool(failed),
+        )
+    )
+    event.add_enrichment([MarkdownBlock("\n\n".join(lines))])